@@ -1,26 +1,60 @@
 import json
+import logging
 import os
-import uuid
-from typing import Any, Dict, List, Literal, Optional, Union
+import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Literal, Optional, Union
 
-import uvicorn
+import httpx
+import orjson
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
-from pydantic import BaseModel
-from rich import print
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from openai import APIError, APIStatusError, AsyncOpenAI
+from pydantic import BaseModel, ValidationError
+from rich.logging import RichHandler
+from rich.markup import escape
 
 load_dotenv()
-app = FastAPI()
 
-client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"), base_url="https://api.groq.com/openai/v1"
+# One pooled HTTP/2 connection set to Groq, shared by every request. httpx applies
+# the read timeout to each read, not the whole response, so long streams are fine;
+# it only trips when Groq goes silent. 600s is the SDK's own default.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=1000, max_keepalive_connections=200, keepalive_expiry=60.0),
+    timeout=httpx.Timeout(600.0, connect=5.0),
 )
+client = AsyncOpenAI(
+    api_key=os.getenv("GROQ_API_KEY"),
+    base_url="https://api.groq.com/openai/v1",
+    http_client=http_client,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 GROQ_MODEL = "moonshotai/kimi-k2-instruct"
 GROQ_MAX_OUTPUT_TOKENS = 16384
 
+# Per-request and per-tool logging is only emitted when PROXY_DEBUG is set.
+# Messages use Rich markup, so client- and Groq-supplied text is passed
+# through escape() to keep brackets in it from being parsed as tags.
+logger = logging.getLogger("proxy")
+# Worker processes run this module twice (as __mp_main__ and as proxy), and
+# both share the "proxy" logger, so only the first run attaches a handler.
+if not logger.handlers:
+    logger.addHandler(RichHandler(markup=True, show_path=False))
+logger.setLevel(logging.DEBUG if os.getenv("PROXY_DEBUG") else logging.WARNING)
+logger.propagate = False
+
 
 # ---------- Anthropic Schema ----------
 class ContentBlock(BaseModel):
@@ -59,24 +93,45 @@ class MessagesRequest(BaseModel):
 # ---------- Conversion Helpers ----------
 
 
+def _dbg(msg_factory: Callable[[], str]) -> None:
+    # Takes a callable so the message is only formatted when it will be logged.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg_factory())
+
+
+def new_message_id() -> str:
+    # Echo-only id, not a secret: the in-process PRNG avoids a getrandom syscall.
+    return "msg_%012x" % random.getrandbits(48)
+
+
+def _dumps(value: Any, indent: bool = False) -> str:
+    # Client-supplied JSON may hold integers beyond 64 bits, which orjson rejects.
+    try:
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 if indent else None).decode()
+    except TypeError:
+        return json.dumps(value, ensure_ascii=False, indent=2 if indent else None, separators=None if indent else (",", ":"))
+
+
+def render_block(block: Union[ContentBlock, ToolUseBlock, ToolResultBlock]) -> str:
+    if block.type == "text":
+        return block.text
+    if block.type == "tool_use":
+        return f"[Tool Use: {block.name}] {_dumps(block.input)}"
+    _dbg(lambda: f"[bold yellow]📥 Tool Result for {escape(block.tool_use_id)}: {escape(_dumps(block.content, indent=True))}[/bold yellow]")
+    return f"<tool_result>{_dumps(block.content)}</tool_result>"
+
+
 def convert_messages(messages: List[Message]) -> List[dict]:
     converted = []
     for m in messages:
-        if isinstance(m.content, str):
-            content = m.content
-        else:
-            parts = []
-            for block in m.content:
-                if block.type == "text":
-                    parts.append(block.text)
-                elif block.type == "tool_use":
-                    tool_info = f"[Tool Use: {block.name}] {json.dumps(block.input)}"
-                    parts.append(tool_info)
-                elif block.type == "tool_result":
-                    result = block.content
-                    print(f"[bold yellow]📥 Tool Result for {block.tool_use_id}: {json.dumps(result, indent=2)}[/bold yellow]")
-                    parts.append(f"<tool_result>{json.dumps(result)}</tool_result>")
-            content = "\n".join(parts)
+        content = m.content
+        if isinstance(content, list):
+            # The overwhelmingly common shape is a single plain text block.
+            content = (
+                content[0].text
+                if len(content) == 1 and content[0].type == "text"
+                else "\n".join(render_block(block) for block in content)
+            )
         converted.append({"role": m.role, "content": content})
     return converted
 
@@ -97,25 +152,264 @@ def convert_tools(tools: List[Tool]) -> List[dict]:
 
 
 def convert_tool_calls_to_anthropic(tool_calls) -> List[dict]:
-    content = []
-    for call in tool_calls:
-        fn = call.function
-        arguments = json.loads(fn.arguments)
+    # Stdlib json keeps integers beyond 64 bits exact, where orjson would turn
+    # them into floats; this runs once per tool call, not per token.
+    content = [
+        {
+            "type": "tool_use",
+            "id": call.id,
+            "name": call.function.name,
+            "input": json.loads(call.function.arguments),
+        }
+        for call in tool_calls
+    ]
+    if logger.isEnabledFor(logging.DEBUG):
+        for block in content:
+            logger.debug(f"[bold green]🛠 Tool Call: {escape(block['name'])}({escape(_dumps(block['input'], indent=True))})[/bold green]")
+    return content
+
+
+# ---------- Streaming ----------
+
+STOP_REASONS = {"tool_calls": "tool_use", "length": "max_tokens"}
+
+
+SSE_PREFIXES = {
+    event: b"event: " + event.encode() + b"\ndata: "
+    for event in (
+        "message_start",
+        "content_block_start",
+        "content_block_delta",
+        "content_block_stop",
+        "message_delta",
+        "message_stop",
+        "error",
+    )
+}
 
-        print(f"[bold green]🛠 Tool Call: {fn.name}({json.dumps(arguments, indent=2)})[/bold green]")
 
-        content.append(
-            {"type": "tool_use", "id": call.id, "name": fn.name, "input": arguments}
+def sse(event: str, data: dict) -> bytes:
+    return SSE_PREFIXES[event] + orjson.dumps(data) + b"\n\n"
+
+
+def sse_template(event: str, data: dict) -> bytes:
+    # Serialize once with placeholders, then swap them for %-format specifiers
+    # so each request renders the frame with a single bytes % (...).
+    # "%JSON%" takes an already-serialized value, e.g. orjson.dumps(text).
+    return (
+        sse(event, data)
+        .replace(b'"%INT%"', b"%d")
+        .replace(b'"%STR%"', b'"%b"')
+        .replace(b'"%JSON%"', b"%b")
+    )
+
+
+# Frames whose only varying parts are the message id, block index and delta text.
+MESSAGE_START = sse_template(
+    "message_start",
+    {
+        "type": "message_start",
+        "message": {
+            "id": "%STR%",
+            "type": "message",
+            "role": "assistant",
+            "model": f"groq/{GROQ_MODEL}",
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": 0, "output_tokens": 0},
+        },
+    },
+)
+TEXT_BLOCK_START = sse_template(
+    "content_block_start",
+    {"type": "content_block_start", "index": "%INT%", "content_block": {"type": "text", "text": ""}},
+)
+TEXT_DELTA = sse_template(
+    "content_block_delta",
+    {"type": "content_block_delta", "index": "%INT%", "delta": {"type": "text_delta", "text": "%JSON%"}},
+)
+INPUT_JSON_DELTA = sse_template(
+    "content_block_delta",
+    {"type": "content_block_delta", "index": "%INT%", "delta": {"type": "input_json_delta", "partial_json": "%JSON%"}},
+)
+CONTENT_BLOCK_STOP = sse_template("content_block_stop", {"type": "content_block_stop", "index": "%INT%"})
+MESSAGE_STOP = sse("message_stop", {"type": "message_stop"})
+
+
+def stream_error(error_type: str, message: str) -> bytes:
+    # Once the 200 is sent, failures can only be reported as an error event.
+    logger.error(f"[bold red]❌ Groq stream error: {escape(message)}[/bold red]")
+    return sse("error", {"type": "error", "error": {"type": error_type, "message": message}})
+
+
+async def groq_chunks(response: httpx.Response) -> AsyncGenerator[List[dict], None]:
+    # Parse Groq's SSE lines ourselves: we only read a few fields per chunk, so
+    # building the SDK's ChatCompletionChunk model for every token is wasted work.
+    # Chunks are yielded per network read so their frames go out in one write.
+    tail = b""
+    try:
+        async for data in response.aiter_bytes():
+            lines = (tail + data).split(b"\n")
+            tail = lines.pop()
+            chunks = []
+            for line in lines:
+                if not line.startswith(b"data: "):
+                    continue
+                payload = line[6:].rstrip(b"\r")
+                if payload == b"[DONE]":
+                    if chunks:
+                        yield chunks
+                    return
+                chunks.append(orjson.loads(payload))
+            if chunks:
+                yield chunks
+    finally:
+        await response.aclose()
+
+
+async def anthropic_stream(groq_stream: AsyncGenerator[List[dict], None], msg_id: str) -> AsyncIterator[bytes]:
+    # message_start goes out on its own so the first byte never waits on Groq.
+    yield MESSAGE_START % msg_id.encode()
+
+    # Anthropic content blocks are numbered sequentially; `current` is the
+    # open block ("text" or the Groq tool-call index) so we know when to close it.
+    index = -1
+    current = None
+    stop_reason = "end_turn"
+    usage = {}
+
+    try:
+        async for chunks in groq_stream:
+            # Every frame rendered from one upstream read is sent as one write.
+            frames = []
+            for chunk in chunks:
+                # Groq reports failures such as tool_use_failed as a chunk with no choices.
+                error = chunk.get("error")
+                if error is not None:
+                    error_type = error.get("type")
+                    frames.append(
+                        stream_error(
+                            error_type if error_type in ERROR_TYPES.values() else "api_error",
+                            error.get("message") or "Unknown Groq error",
+                        )
+                    )
+                    yield b"".join(frames)
+                    return
+                # With include_usage the totals arrive on a final chunk with no
+                # choices; Groq also reports them under x_groq on the last chunk.
+                chunk_usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+                if chunk_usage:
+                    usage = chunk_usage
+                if not chunk.get("choices"):
+                    continue
+                choice = chunk["choices"][0]
+                delta = choice.get("delta") or {}
+                text = delta.get("content")
+
+                if text:
+                    if current != "text":
+                        if current is not None:
+                            frames.append(CONTENT_BLOCK_STOP % index)
+                        index += 1
+                        current = "text"
+                        frames.append(TEXT_BLOCK_START % index)
+                    frames.append(TEXT_DELTA % (index, orjson.dumps(text)))
+
+                for call in delta.get("tool_calls") or ():
+                    fn = call.get("function") or {}
+                    if current != call["index"]:
+                        if current is not None:
+                            frames.append(CONTENT_BLOCK_STOP % index)
+                        index += 1
+                        current = call["index"]
+                        _dbg(lambda: f"[bold green]🛠 Tool Call: {escape(str(fn.get('name')))}[/bold green]")
+                        frames.append(
+                            sse(
+                                "content_block_start",
+                                {
+                                    "type": "content_block_start",
+                                    "index": index,
+                                    "content_block": {"type": "tool_use", "id": call.get("id"), "name": fn.get("name"), "input": {}},
+                                },
+                            )
+                        )
+                    if fn.get("arguments"):
+                        frames.append(INPUT_JSON_DELTA % (index, orjson.dumps(fn["arguments"])))
+
+                if choice.get("finish_reason"):
+                    stop_reason = STOP_REASONS.get(choice["finish_reason"], "end_turn")
+            if frames:
+                yield b"".join(frames)
+    except httpx.HTTPError as exc:
+        yield stream_error(
+            "api_error", "Request timed out." if isinstance(exc, httpx.TimeoutException) else "Connection error."
         )
-    return content
+        return
+    finally:
+        await groq_stream.aclose()
+
+    frames = [CONTENT_BLOCK_STOP % index] if current is not None else []
+    frames.append(
+        sse(
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                "usage": {
+                    "input_tokens": usage.get("prompt_tokens", 0),
+                    "output_tokens": usage.get("completion_tokens", 0),
+                },
+            },
+        )
+    )
+    frames.append(MESSAGE_STOP)
+    yield b"".join(frames)
+
+
+# ---------- Error Handling ----------
+
+# Anthropic error types for the upstream status codes clients act on.
+ERROR_TYPES = {
+    400: "invalid_request_error",
+    401: "authentication_error",
+    403: "permission_error",
+    404: "not_found_error",
+    413: "request_too_large",
+    429: "rate_limit_error",
+}
+
+
+@app.exception_handler(APIError)
+async def groq_error(request: Request, exc: APIError):
+    # Forward Groq's status so clients can retry on 429/5xx; connection
+    # failures and timeouts have no status and become a 502.
+    status = exc.status_code if isinstance(exc, APIStatusError) else 502
+    # exc.message embeds the SDK's repr of the error body; prefer Groq's own text.
+    message = (exc.body.get("message") if isinstance(exc.body, dict) else None) or exc.message
+    logger.error(f"[bold red]❌ Groq error ({status}): {escape(message)}[/bold red]")
+    body = {
+        "type": "error",
+        "error": {"type": ERROR_TYPES.get(status, "api_error"), "message": message},
+    }
+    return Response(content=orjson.dumps(body), status_code=status, media_type="application/json")
 
 
 # ---------- Main Proxy Route ----------
 
 
 @app.post("/v1/messages")
-async def proxy(request: MessagesRequest):
-    print(f"[bold cyan]🚀 Anthropic → Groq | Model: {request.model}[/bold cyan]")
+async def proxy(http_request: Request):
+    # Validate the raw bytes in pydantic-core rather than letting FastAPI
+    # json.loads the body into dicts first and validate those.
+    try:
+        request = MessagesRequest.model_validate_json(await http_request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+    _dbg(lambda: f"[bold cyan]🚀 Anthropic → Groq | Model: {escape(request.model)}[/bold cyan]")
 
     openai_messages = convert_messages(request.messages)
     tools = convert_tools(request.tools) if request.tools else None
@@ -123,16 +417,27 @@ async def proxy(request: MessagesRequest):
     max_tokens = min(request.max_tokens or GROQ_MAX_OUTPUT_TOKENS, GROQ_MAX_OUTPUT_TOKENS)
     
     if request.max_tokens and request.max_tokens > GROQ_MAX_OUTPUT_TOKENS:
-        print(f"[bold yellow]⚠️  Capping max_tokens from {request.max_tokens} to {GROQ_MAX_OUTPUT_TOKENS}[/bold yellow]")
-
-    completion = client.chat.completions.create(
-        model=GROQ_MODEL,
-        messages=openai_messages,
-        temperature=request.temperature,
-        max_tokens=max_tokens,
-        tools=tools,
-        tool_choice=request.tool_choice,
-    )
+        logger.warning(f"[bold yellow]⚠️  Capping max_tokens from {request.max_tokens} to {GROQ_MAX_OUTPUT_TOKENS}[/bold yellow]")
+
+    params = {
+        "model": GROQ_MODEL,
+        "messages": openai_messages,
+        "temperature": request.temperature,
+        "max_tokens": max_tokens,
+        "tools": tools,
+        "tool_choice": request.tool_choice,
+    }
+
+    if request.stream:
+        raw = await client.chat.completions.with_raw_response.create(
+            **params, stream=True, stream_options={"include_usage": True}
+        )
+        return StreamingResponse(
+            anthropic_stream(groq_chunks(raw.http_response), new_message_id()),
+            media_type="text/event-stream",
+        )
+
+    completion = await client.chat.completions.create(**params)
 
     choice = completion.choices[0]
     msg = choice.message
@@ -144,8 +449,8 @@ async def proxy(request: MessagesRequest):
         tool_content = [{"type": "text", "text": msg.content}]
         stop_reason = "end_turn"
 
-    return {
-        "id": f"msg_{uuid.uuid4().hex[:12]}",
+    body = {
+        "id": new_message_id(),
         "model": f"groq/{GROQ_MODEL}",
         "role": "assistant",
         "type": "message",
@@ -157,6 +462,7 @@ async def proxy(request: MessagesRequest):
             "output_tokens": completion.usage.completion_tokens,
         },
     }
+    return Response(content=_dumps(body), media_type="application/json")
 
 
 @app.get("/")
@@ -165,4 +471,14 @@ def root():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=7187)
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Extra worker processes import the app themselves, which needs an import string.
+    uvicorn.run(
+        "proxy:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=7187,
+        access_log=False,
+        workers=workers,
+    )
@@ -0,0 +1,36 @@
+import os
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+# proxy builds its Groq client at import time, which needs a key to be set.
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+import proxy  # noqa: E402
+
+
+@pytest.fixture
+def groq(monkeypatch):
+    """Route the proxy's Groq client through an httpx.MockTransport.
+
+    Call the returned function with a request handler; it returns a
+    TestClient for the app.
+    """
+
+    def install(handler):
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(
+            proxy,
+            "client",
+            AsyncOpenAI(
+                api_key="test",
+                base_url="https://api.groq.com/openai/v1",
+                http_client=http_client,
+                max_retries=0,
+            ),
+        )
+        return TestClient(proxy.app)
+
+    return install
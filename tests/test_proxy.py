@@ -0,0 +1,214 @@
+import asyncio
+import json
+
+import httpx
+import orjson
+import pytest
+
+import proxy
+
+REQUEST = {"model": "claude", "max_tokens": 100, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def chunk(delta=None, finish_reason=None, **extra):
+    choices = [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}]
+    return {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m", "choices": choices, **extra}
+
+
+def sse_body(*payloads, done=True):
+    """Encode chunks as Groq SSE, one network read per payload."""
+
+    async def body():
+        for payload in payloads:
+            yield b"data: " + (payload if isinstance(payload, bytes) else orjson.dumps(payload)) + b"\n\n"
+        if done:
+            yield b"data: [DONE]\n\n"
+
+    return body()
+
+
+def streaming(body):
+    return lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body)
+
+
+def events(text):
+    parsed = []
+    for frame in text.strip().split("\n\n"):
+        event, data = frame.split("\n")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+USAGE = {"prompt_tokens": 7, "completion_tokens": 5, "total_tokens": 12}
+
+TEXT_THEN_TOOL = [
+    chunk({"role": "assistant", "content": "Hel"}),
+    chunk({"content": "lo"}),
+    chunk({"tool_calls": [{"index": 0, "id": "call_1", "type": "function", "function": {"name": "Bash", "arguments": '{"cmd":'}}]}),
+    chunk({"tool_calls": [{"index": 0, "function": {"arguments": '"ls"}'}}]}),
+    chunk(finish_reason="tool_calls", x_groq={"usage": USAGE}),
+]
+
+
+def test_stream_text_then_tool_use(groq):
+    client = groq(streaming(sse_body(*TEXT_THEN_TOOL)))
+    response = client.post("/v1/messages", json={**REQUEST, "stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    parsed = events(response.text)
+    assert [event for event, _ in parsed] == [
+        "message_start",
+        "content_block_start",
+        "content_block_delta",
+        "content_block_delta",
+        "content_block_stop",
+        "content_block_start",
+        "content_block_delta",
+        "content_block_delta",
+        "content_block_stop",
+        "message_delta",
+        "message_stop",
+    ]
+    assert parsed[1][1] == {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}
+    assert "".join(data["delta"]["text"] for _, data in parsed[2:4]) == "Hello"
+    assert parsed[5][1]["index"] == 1
+    assert parsed[5][1]["content_block"] == {"type": "tool_use", "id": "call_1", "name": "Bash", "input": {}}
+    assert "".join(data["delta"]["partial_json"] for _, data in parsed[6:8]) == '{"cmd":"ls"}'
+    assert parsed[9][1]["delta"]["stop_reason"] == "tool_use"
+
+
+@pytest.mark.parametrize(
+    "tail",
+    [
+        [chunk(finish_reason="stop", x_groq={"usage": USAGE})],
+        [chunk(finish_reason="stop"), {"id": "c", "object": "chat.completion.chunk", "choices": [], "usage": USAGE}],
+    ],
+    ids=["x_groq", "include_usage"],
+)
+def test_stream_reports_usage(groq, tail):
+    client = groq(streaming(sse_body(chunk({"content": "hi"}), *tail)))
+    parsed = events(client.post("/v1/messages", json={**REQUEST, "stream": True}).text)
+
+    assert parsed[-2] == (
+        "message_delta",
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"input_tokens": 7, "output_tokens": 5},
+        },
+    )
+    assert parsed[-1][0] == "message_stop"
+
+
+def test_stream_forwards_in_stream_error(groq):
+    error = {"error": {"message": "Failed to call a function", "type": "invalid_request_error", "code": "tool_use_failed"}}
+    client = groq(streaming(sse_body(chunk({"content": "hi"}), error, done=False)))
+    response = client.post("/v1/messages", json={**REQUEST, "stream": True})
+
+    assert response.status_code == 200
+    parsed = events(response.text)
+    assert parsed[-1] == (
+        "error",
+        {"type": "error", "error": {"type": "invalid_request_error", "message": "Failed to call a function"}},
+    )
+    assert "message_stop" not in [event for event, _ in parsed]
+
+
+def test_stream_reports_dropped_connection(groq):
+    async def body():
+        yield b"data: " + orjson.dumps(chunk({"content": "hi"})) + b"\n\n"
+        raise httpx.ReadError("connection reset")
+
+    client = groq(streaming(body()))
+    parsed = events(client.post("/v1/messages", json={**REQUEST, "stream": True}).text)
+
+    assert parsed[-1] == ("error", {"type": "error", "error": {"type": "api_error", "message": "Connection error."}})
+
+
+def test_stream_batches_frames_per_read(groq):
+    # Two chunks delivered in one network read become one write.
+    both = orjson.dumps(chunk({"content": "a"})) + b"\n\ndata: " + orjson.dumps(chunk({"content": "b"}))
+    groq(streaming(sse_body(both)))
+
+    async def collect():
+        raw = await proxy.client.chat.completions.with_raw_response.create(model="m", messages=[], stream=True)
+        return [write async for write in proxy.anthropic_stream(proxy.groq_chunks(raw.http_response), "msg_1")]
+
+    writes = asyncio.run(collect())
+    assert [write.count(b"event: ") for write in writes] == [1, 3, 3]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_rate_limit_is_forwarded(groq, stream):
+    client = groq(lambda request: httpx.Response(429, json={"error": {"message": "slow down", "type": "tokens"}}))
+    response = client.post("/v1/messages", json={**REQUEST, "stream": stream})
+
+    assert response.status_code == 429
+    assert response.json() == {"type": "error", "error": {"type": "rate_limit_error", "message": "slow down"}}
+
+
+def test_connection_failure_is_bad_gateway(groq):
+    def refuse(request):
+        raise httpx.ConnectError("refused")
+
+    response = groq(refuse).post("/v1/messages", json=REQUEST)
+
+    assert response.status_code == 502
+    assert response.json()["error"] == {"type": "api_error", "message": "Connection error."}
+
+
+def test_malformed_json_is_rejected(groq):
+    client = groq(lambda request: pytest.fail("Groq must not be called"))
+    response = client.post("/v1/messages", content=b'{"model": "claude", "messages": [', headers={"content-type": "application/json"})
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"][0] == "body"
+
+
+def test_non_stream_tool_call_keeps_large_integers(groq):
+    completion = {
+        "id": "c",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "m",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {"id": "call_1", "type": "function", "function": {"name": "f", "arguments": '{"n": 123456789012345678901234567890}'}}
+                    ],
+                },
+            }
+        ],
+        "usage": USAGE,
+    }
+    client = groq(lambda request: httpx.Response(200, json=completion))
+    body = client.post("/v1/messages", json=REQUEST).json()
+
+    assert body["stop_reason"] == "tool_use"
+    assert body["content"] == [{"type": "tool_use", "id": "call_1", "name": "f", "input": {"n": 123456789012345678901234567890}}]
+    assert body["usage"] == {"input_tokens": 7, "output_tokens": 5}
+
+
+def test_convert_messages():
+    messages = [
+        proxy.Message(role="user", content="plain"),
+        proxy.Message(role="user", content=[{"type": "text", "text": "solo"}]),
+        proxy.Message(
+            role="assistant",
+            content=[{"type": "text", "text": "ok"}, {"type": "tool_use", "id": "t1", "name": "Bash", "input": {"n": 2**70}}],
+        ),
+        proxy.Message(role="user", content=[{"type": "tool_result", "tool_use_id": "t1", "content": "arr[/i]"}]),
+    ]
+
+    assert proxy.convert_messages(messages) == [
+        {"role": "user", "content": "plain"},
+        {"role": "user", "content": "solo"},
+        {"role": "assistant", "content": 'ok\n[Tool Use: Bash] {"n":%d}' % 2**70},
+        {"role": "user", "content": '<tool_result>"arr[/i]"</tool_result>'},
+    ]